@@ -1,7 +1,14 @@
 from flask import Flask,request,redirect,render_template,flash,url_for,session
 from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
-from pymongo import MongoClient
+import os
+import threading
+from bson import ObjectId
+from bson.errors import InvalidId
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # client_factory.py sits at the repo root
+from client_factory import ClientFactory
+from docstore import MemoryStore, MongoStore, SQLiteStore
 from datetime import datetime
 from datetime import datetime
 
@@ -10,11 +17,101 @@ app.config["SECRET_KEY"]= "change-me-in-production"
 
 DB_PATH = "users_data.db"
 
-#MongoDB connection
-mongo_client = MongoClient("mongodb://localhost:27017/")
-mongo_db = mongo_client["stroke_app"]
-feedback_collection = mongo_db["feedbacks"]
-history_collection = mongo_db["medical_history"]
+#MongoDB connection, made on first use in each worker process (see client_factory.py)
+clients = ClientFactory(mongo_url=os.getenv("MONGO_URL", "mongodb://localhost:27017/"))
+mongo_db = clients.mongo_db("stroke_app")
+feedback_collection = clients.mongo_collection("stroke_app", "feedbacks")
+history_collection = clients.mongo_collection("stroke_app", "medical_history")
+
+#MongoDB indexes (created once per process before the first request, or with
+#`flask --app "Main project/app.py" init-indexes`; create_index is a no-op when they exist)
+MONGO_INDEXES = {
+    "medical_history": [[("user_id", 1), ("timestamp", -1), ("_id", -1)]],
+    "feedbacks": [[("user_id", 1)], [("timestamp", -1)]],
+}
+#Feedback storage (see docstore.py): FEEDBACK_STORE=mongo (default), sqlite (a table in DB_PATH)
+#or memory (this process only); made on first use, like the clients
+FEEDBACK_STORES = {
+    "mongo": lambda: MongoStore(feedback_collection),
+    "sqlite": lambda: SQLiteStore(DB_PATH, "feedback_docs"),
+    "memory": MemoryStore,
+}
+FEEDBACK_STORE = os.getenv("FEEDBACK_STORE", "mongo")
+if FEEDBACK_STORE not in FEEDBACK_STORES:
+    raise ValueError(f"FEEDBACK_STORE must be one of {', '.join(FEEDBACK_STORES)}, not {FEEDBACK_STORE!r}")
+_feedback_store = None
+_feedback_store_lock = threading.Lock()
+
+def feedback_store():
+    global _feedback_store
+    if _feedback_store is None:
+        with _feedback_store_lock:
+            if _feedback_store is None:
+                _feedback_store = FEEDBACK_STORES[FEEDBACK_STORE]()
+    return _feedback_store
+
+HISTORY_LIMIT = 50       # snapshots per history page
+HISTORY_LIMIT_MAX = 500
+HISTORY_PROJECTION = {"timestamp": 1, "snapshot": 1}
+
+def init_mongo_indexes():
+    for name, indexes in MONGO_INDEXES.items():
+        for keys in indexes:
+            mongo_db[name].create_index(keys)
+
+_indexes_ready = False
+_indexes_lock = threading.Lock()
+
+@app.before_request
+def ensure_mongo_indexes():
+    #runs under any WSGI server, not only `python app.py`; one attempt per process
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    with _indexes_lock:
+        if _indexes_ready:
+            return
+        _indexes_ready = True
+        try:
+            init_mongo_indexes()
+        except Exception as e:
+            app.logger.warning("could not create MongoDB indexes: %s", e)
+
+@app.cli.command("init-indexes")
+def init_indexes_command():
+    """Create the MongoDB indexes."""
+    init_mongo_indexes()
+    print("indexes ready")
+
+#Query plan check: explain each query shape once and warn on a full collection scan
+_checked_plans = set()
+
+def _plan_stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _plan_stages(value)
+
+def warn_if_collscan(collection, query, sort=None):
+    shape = (collection.name, tuple(sorted(query)), tuple(sort or ()))
+    if shape in _checked_plans:
+        return
+    _checked_plans.add(shape)
+    try:
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+    except Exception as e:
+        app.logger.warning("Could not explain query on %s: %s", collection.name, e)
+        return
+    if "COLLSCAN" in set(_plan_stages(winning)):
+        app.logger.warning("Query on %s %s sorted by %s does a COLLSCAN (missing index?)",
+                           collection.name, sorted(query), sort)
 
 #Database init (email Unique, case_insensitive)
 
@@ -340,8 +437,26 @@ def history():
     if "user_id" not in session:
         flash("Please log in to continue.")
         return redirect(url_for("login"))
-    records = list(history_collection.find({"user_id": session["user_id"]}).sort("timestamp", -1))
-    return render_template("history.html", records=records)
+    limit = min(max(request.args.get("limit", HISTORY_LIMIT, type=int), 1), HISTORY_LIMIT_MAX)
+    query = {"user_id": session["user_id"]}
+    #keyset paging: continue after the last (timestamp, _id) of the previous page
+    before, before_id = request.args.get("before"), request.args.get("before_id")
+    if before and before_id:
+        try:
+            ts, oid = datetime.fromisoformat(before), ObjectId(before_id)
+        except (ValueError, InvalidId):
+            return redirect(url_for("history", limit=limit))
+        query["$or"] = [{"timestamp": {"$lt": ts}}, {"timestamp": ts, "_id": {"$lt": oid}}]
+    sort = [("timestamp", -1), ("_id", -1)]
+    warn_if_collscan(history_collection, query, sort)
+    #only the fields the page shows, newest first, served from the (user_id, timestamp, _id) index
+    records = list(history_collection.find(query, HISTORY_PROJECTION).sort(sort).limit(limit + 1))
+    next_page = None
+    if len(records) > limit:
+        records = records[:limit]
+        last = records[-1]
+        next_page = url_for("history", limit=limit, before=last["timestamp"].isoformat(), before_id=str(last["_id"]))
+    return render_template("history.html", records=records, next_page=next_page)
 
 @app.route("/feedback", methods=["GET", "POST"])
 def feedback():
@@ -357,9 +472,9 @@ def feedback():
             "user_id": session["user_id"],
             "rating": int(rating),
             "comment": comment,
-            "timestamp": datetime.utcnow()
+            "timestamp": datetime.utcnow().isoformat()  #string, so every store sorts it the same
         }
-        feedback_collection.insert_one(feedback_doc)
+        feedback_store().save(feedback_doc)
 
         flash("Thank you for your Feedback!")
         return redirect(url_for("dashboard"))
@@ -1,7 +1,10 @@
 from flask import Flask, request, redirect, render_template, flash, url_for, session
 from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
-from pymongo import MongoClient
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # client_factory.py sits at the repo root
+from client_factory import ClientFactory
 from datetime import datetime
 
 app = Flask(__name__)
@@ -11,11 +14,11 @@ app.config["SECRET_KEY"] = "change-me-in-production"
 DB_PATH_USERS = "users_data.db"
 DB_PATH_ADMINS = "admins_data.db"
 
-# MongoDB connection
-mongo_client = MongoClient("mongodb://localhost:27017/")
-mongo_db = mongo_client["stroke_app"]
-feedback_collection = mongo_db["feedbacks"]
-history_collection = mongo_db["medical_history"]
+# MongoDB connection, made on first use in each worker process (see client_factory.py)
+clients = ClientFactory(mongo_url=os.getenv("MONGO_URL", "mongodb://localhost:27017/"))
+mongo_db = clients.mongo_db("stroke_app")
+feedback_collection = clients.mongo_collection("stroke_app", "feedbacks")
+history_collection = clients.mongo_collection("stroke_app", "medical_history")
 
 # -----------------------------
 # Database initialization
@@ -0,0 +1,108 @@
+"""Compare the docstore backends under the same feedback/history workload.
+
+    python bench_docstore.py --users 200 --docs 20
+    python bench_docstore.py --couch http://admin:pw@127.0.0.1:5984/ --mongo mongodb://localhost:27017/
+
+The in-process and SQLite backends always run; CouchDB and MongoDB only when
+a URL is given. Each backend gets a fresh, throwaway database/collection.
+"""
+import datetime
+import os
+import random
+import tempfile
+import time
+import uuid
+
+import click
+
+from docstore import CouchStore, MemoryStore, MongoStore, SQLiteStore
+
+
+def make_docs(users, docs_per_user, seed):
+    rng = random.Random(seed)
+    start = datetime.datetime(2024, 1, 1)
+    docs = []
+    for user_id in range(1, users + 1):
+        for _ in range(docs_per_user):
+            ts = start + datetime.timedelta(seconds=rng.randrange(365 * 86400))
+            docs.append({
+                "user_id": user_id,
+                "timestamp": ts.isoformat(),
+                "rating": rng.randint(1, 5),
+                "risk_score": round(rng.random(), 3),
+                "comment": rng.choice(["great app", "too slow", "helpful tips", "hard to use"]),
+            })
+    rng.shuffle(docs)
+    return docs
+
+
+def run_workload(store, docs, users, single, lookups, page_size, seed):
+    rng = random.Random(seed)
+    timings = {}
+
+    def timed(name, fn):
+        t0 = time.perf_counter()
+        count = fn()
+        timings[name] = (time.perf_counter() - t0, count)
+
+    timed("save", lambda: len([store.save(d) for d in docs[:single]]))
+    timed("save_many", lambda: len(store.save_many(docs[single:])))
+    timed("by_user", lambda: sum(len(store.by_user(rng.randint(1, users))) for _ in range(lookups)))
+
+    def page_all():
+        seen, before = 0, None
+        while True:
+            page = store.page(before=before, limit=page_size)
+            if not page:
+                return seen
+            seen += len(page)
+            before = (page[-1]["timestamp"], page[-1]["_id"])
+    timed("page", page_all)
+    timed("aggregate", lambda: len(store.aggregate("user_id", "rating")))
+    return timings
+
+
+@click.command()
+@click.option("--users", default=200, show_default=True)
+@click.option("--docs", "docs_per_user", default=20, show_default=True, help="Documents per user.")
+@click.option("--single", default=500, show_default=True, help="How many documents are saved one by one.")
+@click.option("--lookups", default=500, show_default=True, help="by_user queries for random users.")
+@click.option("--page-size", default=50, show_default=True)
+@click.option("--couch", "couch_url", help="CouchDB server URL.")
+@click.option("--mongo", "mongo_url", help="MongoDB connection string.")
+@click.option("--seed", default=1, show_default=True)
+def main(users, docs_per_user, single, lookups, page_size, couch_url, mongo_url, seed):
+    docs = make_docs(users, docs_per_user, seed)
+    single = min(single, len(docs))
+    tmp = tempfile.mkdtemp(prefix="bench_docstore_")
+    name = "bench_" + uuid.uuid4().hex[:8]
+
+    backends = [
+        ("memory", MemoryStore, lambda: None),
+        ("sqlite", lambda: SQLiteStore(os.path.join(tmp, "docs.db"), "docs"), lambda: None),
+    ]
+    if couch_url:
+        import couchdb
+        server = couchdb.Server(couch_url)
+        backends.append(("couchdb", lambda: CouchStore(server.create(name)), lambda: server.delete(name)))
+    if mongo_url:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_url)
+        backends.append(("mongodb", lambda: MongoStore(client[name]["docs"]), lambda: client.drop_database(name)))
+
+    print(f"{len(docs)} documents, {users} users\n")
+    print(f"{'backend':<10}" + "".join(f"{op:>14}" for op in ["save", "save_many", "by_user", "page", "aggregate"]))
+    for label, make, cleanup in backends:
+        try:
+            timings = run_workload(make(), docs, users, single, lookups, page_size, seed)
+        finally:
+            cleanup()
+        # Operations per second, except aggregate which is one call
+        cells = []
+        for op, (secs, count) in timings.items():
+            cells.append(f"{secs * 1000:>11.1f} ms" if op == "aggregate" else f"{count / secs:>10.0f} /s ")
+        print(f"{label:<10}" + "".join(f"{c:>14}" for c in cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Load harness for the SQLite write paths (add_info and analyze).
+
+Runs many patients at once through the real Flask routes against a fresh
+SQLite file, for every combination of journal mode, busy timeout and worker
+count, using threads in one process or separate processes. Half the requests
+are add_info, which updates the users row (the risk score, cohort stats and
+data versions follow through triggers). The other half are analyze, which
+reads, and writes a risk trajectory point only when the patient changed
+since their last snapshot, as it does in production:
+
+    python bench_sqlite_writes.py
+    python bench_sqlite_writes.py --journal wal --journal delete --timeout 0.1 --timeout 5 \
+        --workers 1 --workers 8 --workers 32 --mode process --duration 10 --json results.json
+
+Needs the same environment as the app itself (it imports app.py). CouchDB
+documents go to a throwaway in-memory store during the run so only SQLite
+is measured. The app's connections are timed by replacing app.db_connect;
+sqlite3.connect itself is left alone.
+
+"db wait" is the time spent inside execute()/commit() calls. Under
+contention that is mostly waiting for the database lock; the workers=1 row
+of each configuration is the uncontended baseline.
+"""
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import click
+
+import app as app_module
+
+_wait = threading.local()
+
+
+class _Row:
+    def __init__(self, doc):
+        self.id, self.key, self.doc = doc["_id"], [doc["user_id"], doc["timestamp"]], doc
+
+
+class _MemoryCouchDB:
+    # Enough of couchdb.Database for the routes under test. Keeps each
+    # patient's latest keyframe and the deltas after it, which is all that
+    # save_history_snapshot looks at to decide whether anything changed.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.heads = {}
+
+    def save(self, doc):
+        doc.setdefault("_id", os.urandom(8).hex())
+        with self.lock:
+            if doc.get("type") == "keyframe":
+                self.heads[doc.get("user_id")] = [doc]
+            else:
+                self.heads.setdefault(doc.get("user_id"), []).append(doc)
+        return doc["_id"], "1-bench"
+
+    def update(self, docs):
+        return [(True,) + self.save(d) for d in docs]
+
+    def info(self):
+        return {"update_seq": "0"}
+
+    def view(self, name, startkey=None, descending=False, limit=None, **kwargs):
+        if name != "history/by_user" or not startkey:
+            return []
+        with self.lock:
+            docs = list(self.heads.get(startkey[0], []))
+        rows = [_Row(d) for d in (reversed(docs) if descending else docs)]
+        return rows[:limit] if limit else rows
+
+
+def _timed(fn, *args):
+    t0 = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        _wait.seconds = getattr(_wait, "seconds", 0.0) + time.perf_counter() - t0
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        return _timed(super().execute, *args)
+
+    def executemany(self, *args):
+        return _timed(super().executemany, *args)
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def commit(self):
+        return _timed(super().commit)
+
+
+def _configure(db_users, db_admins, journal, timeout):
+    app_module.DB_PATH_USERS = db_users
+    app_module.DB_PATH_ADMINS = db_admins
+    app_module.history_db = _MemoryCouchDB()
+    app_module.feedback_db = _MemoryCouchDB()
+    app_module.app.config.update(TESTING=True, SECRET_KEY="bench")
+    app_module.profile_cache.clear()
+
+    # Only the app's request-path connections; sqlite3.connect stays as it is
+    def connect(path):
+        conn = sqlite3.connect(path, timeout=timeout, factory=TimedConnection)
+        if journal != "wal":  # WAL is stored in the file, the others are per connection
+            conn.execute(f"PRAGMA journal_mode={journal}")
+        return conn
+    app_module.sqlite_pool = None
+    app_module.db_connect = connect
+
+
+def _prepare(tmp, journal, patients):
+    db_users = os.path.join(tmp, f"users_{journal}.db")
+    db_admins = os.path.join(tmp, "admins.db")
+    for path in (db_users, db_users + "-wal", db_users + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    app_module.DB_PATH_USERS, app_module.DB_PATH_ADMINS = db_users, db_admins
+    app_module.init_db()
+    conn = sqlite3.connect(db_users)
+    conn.execute(f"PRAGMA journal_mode={journal}")
+    conn.executemany("""
+        INSERT INTO users (first_name, last_name, gender, age, work_type, residence_type,
+                           ever_married, email, password)
+        VALUES ('Bench', 'Patient', 'Female', ?, 'Private', 'Urban', 'Yes', ?, 'x')
+    """, [(20 + i % 60, f"bench{i}@example.com") for i in range(patients)])
+    conn.commit()
+    conn.close()
+    return db_users, db_admins
+
+
+def _worker(args):
+    """One simulated patient hammering add_info / analyze until the deadline."""
+    db_users, db_admins, journal, timeout, user_id, start_at, deadline, seed = args
+    _configure(db_users, db_admins, journal, timeout)
+    rng = random.Random(seed)
+    latencies, locked, errors = [], 0, 0
+    _wait.seconds = 0.0
+    with app_module.app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess["user_id"] = user_id
+            sess["role"] = "user"
+        time.sleep(max(0.0, start_at - time.time()))
+        while time.time() < deadline:
+            t0 = time.perf_counter()
+            try:
+                if rng.random() < 0.5:
+                    response = client.post("/add_info", data={
+                        "hypertension": rng.randint(0, 1), "heart_disease": rng.randint(0, 1),
+                        "avg_glucose_level": round(rng.uniform(70, 200), 1), "bmi": round(rng.uniform(18, 40), 1),
+                        "smoking_status": rng.randint(0, 3), "stroke": 0,
+                    })
+                else:
+                    response = client.get("/analyze")
+                if response.status_code >= 500:
+                    errors += 1
+            except sqlite3.OperationalError as e:
+                if "locked" in str(e) or "busy" in str(e):
+                    locked += 1
+                else:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+    return latencies, _wait.seconds, locked, errors
+
+
+def run_config(tmp, mode, journal, timeout, workers, duration, seed):
+    db_users, db_admins = _prepare(tmp, journal, workers)
+    # Everyone starts together, after the processes have started up
+    start_at = time.time() + (2 if mode == "process" else 0.2)
+    deadline = start_at + duration
+    jobs = [(db_users, db_admins, journal, timeout, i + 1, start_at, deadline, seed + i) for i in range(workers)]
+    pool = ProcessPoolExecutor if mode == "process" else ThreadPoolExecutor
+    if mode == "thread":
+        _configure(db_users, db_admins, journal, timeout)
+    with pool(max_workers=workers) as executor:
+        results = list(executor.map(_worker, jobs))
+
+    latencies = sorted(x for r in results for x in r[0])
+    requests = len(latencies)
+    quantile = lambda q: latencies[min(int(q * requests), requests - 1)] * 1000 if requests else 0.0
+    return {
+        "mode": mode, "journal": journal, "timeout": timeout, "workers": workers,
+        "requests": requests,
+        "req_per_s": requests / duration,
+        "p50_ms": quantile(0.50),
+        "p95_ms": quantile(0.95),
+        "p99_ms": quantile(0.99),
+        "db_wait_ms_per_req": sum(r[1] for r in results) * 1000 / requests if requests else 0.0,
+        "locked_pct": 100.0 * sum(r[2] for r in results) / requests if requests else 0.0,
+        "error_pct": 100.0 * sum(r[3] for r in results) / requests if requests else 0.0,
+        "mean_ms": statistics.fmean(latencies) * 1000 if requests else 0.0,
+    }
+
+
+@click.command()
+@click.option("--journal", multiple=True, default=["delete", "wal"], show_default=True,
+              type=click.Choice(["delete", "truncate", "persist", "wal"]))
+@click.option("--timeout", multiple=True, type=float, default=[0.1, 5.0], show_default=True,
+              help="Busy timeout in seconds (sqlite3.connect timeout).")
+@click.option("--workers", multiple=True, type=int, default=[1, 4, 16], show_default=True)
+@click.option("--mode", type=click.Choice(["thread", "process"]), default="thread", show_default=True)
+@click.option("--duration", type=float, default=5.0, show_default=True, help="Seconds per configuration.")
+@click.option("--seed", type=int, default=1, show_default=True)
+@click.option("--json", "json_path", help="Also write the results to this file.")
+def main(journal, timeout, workers, mode, duration, seed, json_path):
+    tmp = tempfile.mkdtemp(prefix="bench_sqlite_")
+    columns = ["journal", "timeout", "workers", "req_per_s", "p50_ms", "p95_ms", "p99_ms",
+               "db_wait_ms_per_req", "locked_pct", "error_pct"]
+    print(f"mode: {mode}, {duration:g}s per configuration, files in {tmp}\n")
+    print("".join(f"{c:>20}" for c in columns))
+    results = []
+    for j in journal:
+        for t in timeout:
+            for w in workers:
+                row = run_config(tmp, mode, j, t, w, duration, seed)
+                results.append(row)
+                print("".join(f"{row[c]:>20.2f}" if isinstance(row[c], float) else f"{row[c]:>20}"
+                              for c in columns))
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""MongoDB / CouchDB clients created lazily, once per process.
+
+Clients made at import time are shared by every worker a pre-fork server
+(gunicorn) forks from the parent, sockets and all. Here nothing connects at
+import: the first use in a process creates that process's client, a fork
+forgets the parent's clients in the child, and close() (also run at exit)
+closes the ones this process opened.
+
+Pool sizes, timeouts and retries come from keyword arguments or the
+environment:
+
+    MONGO_MAX_POOL (20), MONGO_MIN_POOL (0), MONGO_TIMEOUT_MS (5000),
+    MONGO_RETRY (1 = retryable reads/writes on)
+    COUCHDB_MAX_IDLE (10 kept-alive connections), COUCHDB_TIMEOUT (30 s),
+    COUCHDB_RETRIES (3, backing off 0.25 s, 0.5 s, 1 s)
+
+Module-level handles stay plain globals in the apps:
+
+    clients = ClientFactory(couch_url=..., mongo_url=...)
+    history_db = clients.couch_db("patient_history", setup=...)
+    feedback_collection = clients.mongo_collection("stroke_app", "feedbacks")
+"""
+import atexit
+import os
+import threading
+
+import couchdb
+import couchdb.http
+from pymongo import MongoClient, monitoring
+
+
+def _env(name, default, cast=int):
+    value = os.getenv(name)
+    return cast(value) if value not in (None, "") else default
+
+
+class _MongoPoolCounter(monitoring.ConnectionPoolListener):
+    """Connection pool events of one MongoClient, summed over its servers."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.created = self.closed = self.checked_out = self.checked_in = self.waits_failed = 0
+
+    def _bump(self, field):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def connection_created(self, event):
+        self._bump("created")
+
+    def connection_closed(self, event):
+        self._bump("closed")
+
+    def connection_checked_out(self, event):
+        self._bump("checked_out")
+
+    def connection_checked_in(self, event):
+        self._bump("checked_in")
+
+    def connection_check_out_failed(self, event):
+        self._bump("waits_failed")
+
+    # Required by the interface, nothing to count
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+    def snapshot(self):
+        with self.lock:
+            return {"open": self.created - self.closed, "in_use": self.checked_out - self.checked_in,
+                    "created": self.created, "checkouts": self.checked_out, "checkout_failures": self.waits_failed}
+
+
+class _BoundedCouchPool(couchdb.http.ConnectionPool):
+    """couchdb-python keeps every released connection; keep at most max_idle per host."""
+
+    def __init__(self, timeout, max_idle):
+        super().__init__(timeout)
+        self.max_idle = max_idle
+        self.created = self.reused = self.discarded = self.in_use = 0
+
+    def get(self, url):
+        key = tuple(couchdb.http.util.urlsplit(url, "http", False)[:2])
+        with self.lock:
+            reuse = bool(self.conns.get(key))
+        conn = super().get(url)
+        with self.lock:
+            self.in_use += 1
+            if reuse:
+                self.reused += 1
+            else:
+                self.created += 1
+        return conn
+
+    def release(self, url, conn):
+        key = tuple(couchdb.http.util.urlsplit(url, "http", False)[:2])
+        with self.lock:
+            self.in_use -= 1
+            keep = len(self.conns.get(key, [])) < self.max_idle
+            if keep:
+                self.conns.setdefault(key, []).append(conn)
+            else:
+                self.discarded += 1
+        if not keep:
+            conn.close()
+
+    def idle(self):
+        return sum(len(c) for c in self.conns.values())
+
+    def close(self):
+        with self.lock:
+            conns = [c for group in self.conns.values() for c in group]
+            self.conns.clear()
+        for conn in conns:
+            conn.close()
+
+    def snapshot(self):
+        return {"idle": self.idle(), "in_use": self.in_use, "created": self.created,
+                "reused": self.reused, "discarded": self.discarded}
+
+
+class LazyHandle:
+    """Stands in for a client/database/collection until first use in a process."""
+
+    def __init__(self, factory, resolve):
+        self._factory = factory
+        self._resolve = resolve
+        self._target = None
+        self._generation = None
+
+    def _get(self):
+        if self._generation != self._factory.generation:
+            with self._factory.lock:
+                if self._generation != self._factory.generation:
+                    self._target = self._resolve()
+                    self._generation = self._factory.generation
+        return self._target
+
+    def __getattr__(self, name):
+        # Introspection (mock.patch, inspect, copy, pickle) asks for dunder and
+        # private names; answering those must not connect to anything
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._get(), name)
+
+    def __getitem__(self, key):
+        return self._get()[key]
+
+    def __contains__(self, key):
+        return key in self._get()
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __len__(self):
+        return len(self._get())
+
+
+class ClientFactory:
+    def __init__(self, mongo_url=None, couch_url=None, **options):
+        self.mongo_url = mongo_url
+        self.couch_url = couch_url
+        self.options = {
+            "mongo_max_pool": _env("MONGO_MAX_POOL", 20),
+            "mongo_min_pool": _env("MONGO_MIN_POOL", 0),
+            "mongo_timeout_ms": _env("MONGO_TIMEOUT_MS", 5000),
+            "mongo_retry": bool(_env("MONGO_RETRY", 1)),
+            "couch_max_idle": _env("COUCHDB_MAX_IDLE", 10),
+            "couch_timeout": _env("COUCHDB_TIMEOUT", 30.0, float),
+            "couch_retries": _env("COUCHDB_RETRIES", 3),
+        }
+        self.options.update(options)
+        # RLock: resolving a database handle creates the server client first
+        self.lock = threading.RLock()
+        self.generation = 0   # bumped on fork/close so every handle resolves again
+        self.pid = os.getpid()
+        self._mongo = self._mongo_counter = None
+        self._couch = self._couch_pool = None
+        os.register_at_fork(after_in_child=self._forget)
+        atexit.register(self.close)
+
+    def _forget(self):
+        # In a forked child: the parent's sockets aren't ours to use or close
+        self.lock = threading.RLock()
+        self.pid = os.getpid()
+        self._mongo = self._mongo_counter = None
+        self._couch = self._couch_pool = None
+        self.generation += 1
+
+    # -----------------------------
+    # MongoDB
+    # -----------------------------
+    def mongo(self):
+        with self.lock:
+            if self._mongo is None:
+                o = self.options
+                self._mongo_counter = _MongoPoolCounter()
+                self._mongo = MongoClient(
+                    self.mongo_url,
+                    maxPoolSize=o["mongo_max_pool"],
+                    minPoolSize=o["mongo_min_pool"],
+                    serverSelectionTimeoutMS=o["mongo_timeout_ms"],
+                    connectTimeoutMS=o["mongo_timeout_ms"],
+                    waitQueueTimeoutMS=o["mongo_timeout_ms"],
+                    retryWrites=o["mongo_retry"],
+                    retryReads=o["mongo_retry"],
+                    event_listeners=[self._mongo_counter],
+                )
+            return self._mongo
+
+    def mongo_db(self, name):
+        return LazyHandle(self, lambda: self.mongo()[name])
+
+    def mongo_collection(self, db_name, name):
+        return LazyHandle(self, lambda: self.mongo()[db_name][name])
+
+    # -----------------------------
+    # CouchDB
+    # -----------------------------
+    def couch(self):
+        with self.lock:
+            if self._couch is None:
+                o = self.options
+                session = couchdb.http.Session(
+                    timeout=o["couch_timeout"],
+                    retry_delays=[0.25 * 2 ** i for i in range(o["couch_retries"])],
+                )
+                self._couch_pool = session.connection_pool = _BoundedCouchPool(o["couch_timeout"], o["couch_max_idle"])
+                self._couch = couchdb.Server(self.couch_url, session=session)
+            return self._couch
+
+    def couch_server(self):
+        return LazyHandle(self, self.couch)
+
+    def couch_db(self, name, setup=None):
+        """Database handle; created on the server if missing, then setup(db)
+        runs once per process (design documents and the like)."""
+        def resolve():
+            server = self.couch()
+            if name in server:
+                db = server[name]
+            else:
+                try:
+                    db = server.create(name)
+                except couchdb.PreconditionFailed:  # another worker got there first
+                    db = server[name]
+            if setup is not None:
+                setup(db)
+            return db
+        return LazyHandle(self, resolve)
+
+    # -----------------------------
+    # Shutdown / metrics
+    # -----------------------------
+    def close(self):
+        """Close this process's clients (worker exit). Handles reconnect if used again."""
+        if self.pid != os.getpid():
+            return
+        with self.lock:
+            if self._mongo is not None:
+                self._mongo.close()
+            if self._couch_pool is not None:
+                self._couch_pool.close()
+            self._mongo = self._mongo_counter = None
+            self._couch = self._couch_pool = None
+            self.generation += 1
+
+    def metrics(self):
+        o = self.options
+        return {
+            "pid": os.getpid(),
+            "mongo": dict(self._mongo_counter.snapshot(), max_pool=o["mongo_max_pool"])
+                     if self._mongo_counter else None,
+            "couchdb": dict(self._couch_pool.snapshot(), max_idle=o["couch_max_idle"])
+                       if self._couch_pool else None,
+        }
@@ -0,0 +1,255 @@
+"""Feedback / history document stores behind one interface.
+
+app.py keeps these documents in CouchDB, "Main project/app.py" in MongoDB and
+"Main project/app2.py" in SQLite tables. Every backend here offers the same
+operations so they can be swapped per deployment and compared with
+bench_docstore.py.
+
+Documents are plain dicts with a "user_id" and an ISO-format "timestamp"
+(strings, so they sort the same everywhere). Each store assigns a string
+"_id" if the document doesn't have one.
+"""
+import json
+import sqlite3
+import threading
+import uuid
+from bisect import bisect_left, insort
+
+
+def _with_id(doc):
+    doc = dict(doc)
+    doc.setdefault("_id", uuid.uuid4().hex)
+    return doc
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class DocStore:
+    """Interface shared by all backends.
+
+    save(doc) / save_many(docs) return the new ids.
+    by_user(user_id) returns that user's documents, oldest first.
+    page(before=None, limit) returns documents newest first; pass the
+        (timestamp, _id) of the last one as `before` to get the next page.
+    aggregate(group_by, field) returns {key: {"count": docs, "avg": mean of
+        the numeric values of field, or None}}.
+    """
+
+    def save(self, doc):
+        return self.save_many([doc])[0]
+
+    def save_many(self, docs):
+        raise NotImplementedError
+
+    def by_user(self, user_id, limit=None):
+        raise NotImplementedError
+
+    def page(self, before=None, limit=20):
+        raise NotImplementedError
+
+    def aggregate(self, group_by, field):
+        raise NotImplementedError
+
+
+# -----------------------------
+# In-process
+# -----------------------------
+class MemoryStore(DocStore):
+    """Dicts and sorted lists in this process; nothing survives a restart."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = {}   # user_id -> [(timestamp, _id, doc)]
+        self.timeline = []  # every (timestamp, _id, doc), oldest first
+
+    def save_many(self, docs):
+        docs = [_with_id(d) for d in docs]
+        with self.lock:
+            for doc in docs:
+                entry = (doc.get("timestamp") or "", doc["_id"], doc)
+                insort(self.users.setdefault(doc.get("user_id"), []), entry, key=lambda e: e[:2])
+                insort(self.timeline, entry, key=lambda e: e[:2])
+        return [d["_id"] for d in docs]
+
+    def by_user(self, user_id, limit=None):
+        with self.lock:
+            entries = self.users.get(user_id, [])[:limit]
+        return [e[2] for e in entries]
+
+    def page(self, before=None, limit=20):
+        with self.lock:
+            entries = self.timeline
+            if before is not None:
+                entries = entries[:bisect_left(entries, tuple(before), key=lambda e: e[:2])]
+            return [e[2] for e in reversed(entries[-limit:])] if limit else []
+
+    def aggregate(self, group_by, field):
+        groups = {}
+        with self.lock:
+            for _, _, doc in self.timeline:
+                if group_by not in doc:
+                    continue
+                g = groups.setdefault(doc[group_by], [0, 0, 0.0])
+                g[0] += 1
+                if _is_number(doc.get(field)):
+                    g[1] += 1
+                    g[2] += doc[field]
+        return {k: {"count": c, "avg": s / n if n else None} for k, (c, n, s) in groups.items()}
+
+
+# -----------------------------
+# SQLite
+# -----------------------------
+class SQLiteStore(DocStore):
+    """One table per collection: indexed user_id/timestamp plus the JSON body."""
+
+    def __init__(self, path, table):
+        if not table.isidentifier():
+            raise ValueError(f"bad table name: {table!r}")
+        self.path = path
+        self.table = table
+        conn = self._connect()
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id TEXT PRIMARY KEY,
+                user_id,
+                timestamp TEXT,
+                body TEXT NOT NULL
+            )
+        """)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_user ON {table}(user_id, timestamp, id)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_time ON {table}(timestamp, id)")
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def save_many(self, docs):
+        docs = [_with_id(d) for d in docs]
+        conn = self._connect()
+        conn.executemany(f"INSERT INTO {self.table} (id, user_id, timestamp, body) VALUES (?, ?, ?, ?)",
+                         [(d["_id"], d.get("user_id"), d.get("timestamp"), json.dumps(d)) for d in docs])
+        conn.commit()
+        conn.close()
+        return [d["_id"] for d in docs]
+
+    def _bodies(self, sql, params):
+        conn = self._connect()
+        rows = conn.execute(sql, params).fetchall()
+        conn.close()
+        return [json.loads(r[0]) for r in rows]
+
+    def by_user(self, user_id, limit=None):
+        return self._bodies(f"SELECT body FROM {self.table} WHERE user_id = ? ORDER BY timestamp, id LIMIT ?",
+                            (user_id, -1 if limit is None else limit))
+
+    def page(self, before=None, limit=20):
+        if before is None:
+            return self._bodies(f"SELECT body FROM {self.table} ORDER BY timestamp DESC, id DESC LIMIT ?", (limit,))
+        return self._bodies(f"SELECT body FROM {self.table} WHERE (timestamp, id) < (?, ?) "
+                            f"ORDER BY timestamp DESC, id DESC LIMIT ?", (*before, limit))
+
+    def aggregate(self, group_by, field):
+        g, f = "$." + group_by, "$." + field
+        conn = self._connect()
+        rows = conn.execute(f"""
+            SELECT json_extract(body, ?), COUNT(*),
+                   AVG(CASE WHEN json_type(body, ?) IN ('integer', 'real') THEN json_extract(body, ?) END)
+            FROM {self.table}
+            WHERE json_type(body, ?) IS NOT NULL
+            GROUP BY 1
+        """, (g, f, f, g)).fetchall()
+        conn.close()
+        return {k: {"count": c, "avg": avg} for k, c, avg in rows}
+
+
+# -----------------------------
+# MongoDB
+# -----------------------------
+class MongoStore(DocStore):
+    def __init__(self, collection):
+        self.collection = collection
+        collection.create_index([("user_id", 1), ("timestamp", 1), ("_id", 1)])
+        collection.create_index([("timestamp", -1), ("_id", -1)])
+
+    def save_many(self, docs):
+        docs = [_with_id(d) for d in docs]
+        if docs:
+            self.collection.insert_many(docs, ordered=False)
+        return [d["_id"] for d in docs]
+
+    def by_user(self, user_id, limit=None):
+        cursor = self.collection.find({"user_id": user_id}).sort([("timestamp", 1), ("_id", 1)])
+        return list(cursor.limit(limit) if limit else cursor)
+
+    def page(self, before=None, limit=20):
+        query = {}
+        if before is not None:
+            ts, doc_id = before
+            query = {"$or": [{"timestamp": {"$lt": ts}}, {"timestamp": ts, "_id": {"$lt": doc_id}}]}
+        return list(self.collection.find(query).sort([("timestamp", -1), ("_id", -1)]).limit(limit))
+
+    def aggregate(self, group_by, field):
+        rows = self.collection.aggregate([
+            {"$match": {group_by: {"$exists": True}}},
+            # $avg skips values that aren't numbers, like the other backends
+            {"$group": {"_id": "$" + group_by, "count": {"$sum": 1}, "avg": {"$avg": "$" + field}}},
+        ])
+        return {r["_id"]: {"count": r["count"], "avg": r["avg"]} for r in rows}
+
+
+# -----------------------------
+# CouchDB
+# -----------------------------
+class CouchStore(DocStore):
+    DESIGN = "_design/docstore"
+    VIEWS = {
+        "by_user": {"map": "function (doc) { if (doc.user_id !== undefined) { emit([doc.user_id, doc.timestamp], null); } }"},
+        "by_time": {"map": "function (doc) { if (doc.timestamp) { emit(doc.timestamp, null); } }"},
+    }
+    # Aggregations need a view per (group_by, field); sums [docs, numeric values, total]
+    AGGREGATE_MAP = ("function (doc) { if (doc[%(g)s] !== undefined) { var v = doc[%(f)s];"
+                     " var n = typeof v === 'number'; emit(doc[%(g)s], [1, n ? 1 : 0, n ? v : 0]); } }")
+
+    def __init__(self, db):
+        self.db = db
+        self._ensure_views(self.VIEWS)
+
+    def _ensure_views(self, views):
+        design = self.db.get(self.DESIGN) or {"_id": self.DESIGN, "views": {}}
+        if all(design["views"].get(k) == v for k, v in views.items()):
+            return
+        design["views"].update(views)
+        self.db.save(design)
+
+    def save_many(self, docs):
+        docs = [_with_id(d) for d in docs]
+        for ok, doc_id, err in self.db.update(docs):
+            if not ok:
+                raise RuntimeError(f"could not save {doc_id}: {err}")
+        return [d["_id"] for d in docs]
+
+    def by_user(self, user_id, limit=None):
+        options = {"limit": limit} if limit else {}
+        rows = self.db.view("docstore/by_user", startkey=[user_id], endkey=[user_id, {}],
+                            include_docs=True, **options)
+        return [dict(row.doc) for row in rows]
+
+    def page(self, before=None, limit=20):
+        options = {"descending": True, "include_docs": True, "limit": limit}
+        if before is not None:
+            # Same timestamp continues after the last doc id we returned
+            options.update(startkey=before[0], startkey_docid=before[1], skip=1)
+        return [dict(row.doc) for row in self.db.view("docstore/by_time", **options)]
+
+    def aggregate(self, group_by, field):
+        name = f"agg_{group_by}_{field}"
+        self._ensure_views({name: {
+            "map": self.AGGREGATE_MAP % {"g": json.dumps(group_by), "f": json.dumps(field)},
+            "reduce": "_sum",
+        }})
+        return {row.key: {"count": row.value[0], "avg": row.value[2] / row.value[1] if row.value[1] else None}
+                for row in self.db.view(f"docstore/{name}", group=True)}
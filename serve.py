@@ -0,0 +1,105 @@
+"""Production entry point: gunicorn with one app per worker process.
+
+    python serve.py --workers 4 --threads 8 --bind 0.0.0.0:8000
+    python serve.py --sqlite-pool 4          # keep SQLite connections open per worker
+
+Every option can also come from the environment (APP_WORKERS, APP_THREADS,
+APP_BIND, APP_TIMEOUT, APP_MAX_REQUESTS, SQLITE_POOL_SIZE, LOGIN_THROTTLE_DB,
+TRUSTED_PROXIES).
+The app is loaded once in the master, where create_app() sets up the
+databases, and then forked; each worker runs init_worker() after the fork and closes its
+CouchDB/Mongo clients on exit.
+
+Workers default to the CPU count: the patient pages are mostly CPU
+(templates, scoring, compression) and SQLite writes serialize anyway, so
+more processes than cores only adds lock waits. Threads cover the time
+spent waiting on CouchDB.
+
+The default bind is loopback, for running behind a reverse proxy (nginx and
+the like). Then every request comes from the proxy's address, so pass
+--trusted-proxies 1 (one per proxy hop) to take the client address from
+X-Forwarded-For; the per-address login limits depend on it. Don't set it
+when clients can reach the server directly, or they can pick their address.
+
+gunicorn is optional (it doesn't run on Windows); without it the app runs
+on werkzeug's threaded server, which is only meant for trying things out.
+"""
+import os
+
+import click
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+
+def _post_fork(server, worker):
+    import app as app_module
+    app_module.init_worker()
+
+
+def _worker_exit(server, worker):
+    import app as app_module
+    app_module.clients.close()
+
+
+if BaseApplication is not None:
+    class Server(BaseApplication):
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+
+@click.command()
+@click.option("--bind", envvar="APP_BIND", default="127.0.0.1:8000", show_default=True)
+@click.option("--workers", envvar="APP_WORKERS", type=int, default=os.cpu_count() or 1, show_default=True)
+@click.option("--threads", envvar="APP_THREADS", type=int, default=4, show_default=True,
+              help="Threads per worker (gthread worker).")
+@click.option("--timeout", envvar="APP_TIMEOUT", type=int, default=60, show_default=True,
+              help="Seconds before a stuck worker is restarted.")
+@click.option("--max-requests", envvar="APP_MAX_REQUESTS", type=int, default=5000, show_default=True,
+              help="Recycle a worker after this many requests (0 = never).")
+@click.option("--sqlite-pool", envvar="SQLITE_POOL_SIZE", type=int, default=0, show_default=True,
+              help="Idle SQLite connections kept per database file and worker (0 = off).")
+@click.option("--login-throttle-db", envvar="LOGIN_THROTTLE_DB", default=None,
+              help="SQLite file the workers share login attempt limits through (default: per worker).")
+@click.option("--trusted-proxies", envvar="TRUSTED_PROXIES", type=click.IntRange(min=0), default=0, show_default=True,
+              help="Reverse proxies in front of the server whose X-Forwarded-* headers are trusted.")
+def main(bind, workers, threads, timeout, max_requests, sqlite_pool, login_throttle_db, trusted_proxies):
+    import app as app_module
+    application = app_module.create_app({"SQLITE_POOL_SIZE": sqlite_pool, "LOGIN_THROTTLE_DB": login_throttle_db,
+                                         "TRUSTED_PROXIES": trusted_proxies})
+
+    if BaseApplication is None:
+        host, _, port = bind.rpartition(":")
+        print("gunicorn is not installed; using the werkzeug development server (one process)")
+        application.run(host=host or "127.0.0.1", port=int(port), threaded=True)
+        return
+
+    Server(application, {
+        "bind": bind,
+        "workers": workers,
+        "threads": threads,
+        "worker_class": "gthread",
+        "preload_app": True,           # create_app / init_db run once, in the master
+        "timeout": timeout,
+        "graceful_timeout": 30,
+        "keepalive": 5,
+        "max_requests": max_requests,
+        "max_requests_jitter": max_requests // 10,
+        "post_fork": _post_fork,
+        "worker_exit": _worker_exit,
+    }).run()
+
+
+if __name__ == "__main__":
+    main()
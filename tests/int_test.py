@@ -37,12 +37,13 @@ def client(test_db):
     with app.test_client() as client:
         yield client
 
-# Mock CouchDB to avoid real connections
+# Mock CouchDB to avoid real connections (and keep background jobs that would use it from starting)
 @pytest.fixture(autouse=True)
 def mock_couchdb():
     with patch('app.couch') as mock_couch, \
          patch('app.feedback_db') as mock_feedback_db, \
-         patch('app.history_db') as mock_history_db:
+         patch('app.history_db') as mock_history_db, \
+         patch('app.start_background', return_value=None):
         mock_couch.create.return_value = MagicMock()
         mock_feedback_db.save = MagicMock()
         mock_history_db.save = MagicMock()
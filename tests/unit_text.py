@@ -3,16 +3,56 @@ from unittest.mock import patch, MagicMock
 import sqlite3
 import os
 import tempfile
-from app import app, init_db, compute_risk, DB_PATH_USERS, DB_PATH_ADMINS  # Ensure your app file is named app.py
+import gzip
+import itertools
+import re
+from flask import url_for
+from app import (app, init_db, compute_risk, load_cohorts, rebuild_cohort_stats, recompute_risk_scores,
+                 PatientColumns, save_history_snapshot, load_patient_history, load_history_page, patient_state_at,
+                 plan_history_compaction, update_risk_trajectory, load_risk_trajectory,
+                 profile_cache, login_throttle, process_purge_queue, build_assets, load_asset_manifest,
+                 DB_PATH_USERS, DB_PATH_ADMINS)  # Ensure your app file is named app.py
+from docstore import MemoryStore, SQLiteStore
 
 # Fixture for Flask test client
 @pytest.fixture
 def client():
     app.config['TESTING'] = True
     app.config['SECRET_KEY'] = 'test-secret-key'
+    profile_cache.clear()
+    login_throttle.clear()
     with app.test_client() as client:
         yield client
 
+# No CouchDB or background threads in unit tests: tests that care patch these again themselves
+@pytest.fixture(autouse=True)
+def no_couchdb():
+    with patch('app.couch'), patch('app.feedback_db'), patch('app.history_db'), \
+         patch('app.start_background', return_value=None):
+        yield
+
+# Fixture for real databases: fresh users/admins files set up by init_db,
+# and a connection to the users one
+@pytest.fixture
+def users_db(tmp_path):
+    db_path = str(tmp_path / "users.db")
+    with patch('app.DB_PATH_USERS', db_path), patch('app.DB_PATH_ADMINS', str(tmp_path / "admins.db")):
+        init_db()
+        conn = sqlite3.connect(db_path)
+        yield conn
+        conn.close()
+
+_emails = itertools.count(1)
+
+# Insert one user per dict of columns; name, email and password get placeholders
+def add_users(conn, *users):
+    for user in users:
+        user = {"first_name": "P", "last_name": "T", "password": "pw", **user}
+        user.setdefault("email", f"user{next(_emails)}@example.com")
+        conn.execute(f"INSERT INTO users ({', '.join(user)}) VALUES ({', '.join('?' * len(user))})",
+                     list(user.values()))
+    conn.commit()
+
 # Fixture to mock databases
 @pytest.fixture
 def mock_db():
@@ -417,8 +457,8 @@ def test_feedback(mock_connect, mock_feedback_db, client):
     mock_conn.cursor.return_value = mock_cursor
     mock_connect.return_value = mock_conn
     
-    # Mock fetchone to return a tuple
-    mock_cursor.fetchone.return_value = (0.5,)
+    # Mock fetchone to return the user's row
+    mock_cursor.fetchone.return_value = {'id': 1, 'risk_score': 0.5}
     
     with client.session_transaction() as sess:
         sess['user_id'] = 1
@@ -432,8 +472,10 @@ def test_feedback(mock_connect, mock_feedback_db, client):
     mock_feedback_db.save.assert_called()
 
 # Test history route
+@patch('app.sqlite3.connect')
 @patch('app.history_db')
-def test_history(mock_history_db, client):
+def test_history(mock_history_db, mock_connect, client):
+    mock_connect.return_value.cursor.return_value.fetchone.return_value = None  # no risk trend yet
     mock_row = MagicMock()
     mock_row.doc = {'user_id': 1, 'timestamp': '2023-01-01'}
     mock_history_db.view.return_value = [mock_row]
@@ -459,6 +501,695 @@ def test_admin_delete_user(mock_connect, client):
     assert response.status_code == 302
     mock_cursor.execute.assert_called_with("DELETE FROM users WHERE id=?", (1,))
 
+# Test cohort aggregates follow inserts, updates and deletes on users
+def test_cohort_stats_triggers(users_db):
+    add_users(users_db, {"gender": "Male", "age": 65, "email": "a@example.com", "risk_score": 0.8},
+              {"gender": "Female", "age": 35, "email": "b@example.com", "risk_score": 0.2})
+    cursor = users_db.cursor()
+    cursor.execute("UPDATE users SET gender='Female', risk_score=0.5 WHERE email='a@example.com'")
+    cursor.execute("DELETE FROM users WHERE email='b@example.com'")
+    users_db.commit()
+
+    cohorts = load_cohorts(cursor)
+    assert cohorts["gender"] == [{
+        "bucket": "Female", "patients": 1, "avg_risk": 0.5,
+        "high_risk": 0, "medium_risk": 1, "low_risk": 0
+    }]
+    assert [c["bucket"] for c in cohorts["age_band"]] == ["60+"]
+
+    # A rebuild from scratch gives the same numbers as the triggers
+    rebuild_cohort_stats(cursor)
+    assert load_cohorts(cursor) == cohorts
+
+# Test the background recompute rescored stale rows and can resume
+def test_recompute_risk_scores(users_db):
+    patient = {"bmi": 31.0, "avg_glucose_level": 90.0, "hypertension": 1, "heart_disease": 0}
+    add_users(users_db, *[dict(patient, age=65)] * 5, dict(patient, age="unknown"))
+    users_db.execute("UPDATE users SET risk_score=0")  # stale, as after a change to the rules
+    users_db.commit()
+
+    with pytest.raises(ValueError):
+        recompute_risk_scores(duty_cycle=0)
+    # The row compute_risk can't read is skipped, not the whole job
+    assert recompute_risk_scores(workers=2, range_size=2, duty_cycle=1.0) == 5
+    assert users_db.execute("SELECT DISTINCT risk_score FROM users WHERE id <= 5").fetchall() == [(0.6,)]
+    assert users_db.execute("SELECT COUNT(*) FROM risk_recompute_ranges WHERE finished_at IS NULL").fetchone()[0] == 0
+
+    # Every range is checkpointed, so a rerun of the same job does nothing
+    users_db.execute("UPDATE users SET risk_score=0")
+    users_db.commit()
+    assert recompute_risk_scores(workers=2, range_size=2, duty_cycle=1.0) == 0
+    assert recompute_risk_scores(workers=2, range_size=2, duty_cycle=1.0, restart=True) == 5
+
+# Test the column store loads once and follows writes through data_versions
+def test_patient_columns(tmp_path, users_db):
+    add_users(users_db, {"gender": "Male", "age": 50}, {"gender": "Female", "age": 50}, {"gender": "Male", "age": 50})
+    cursor = users_db.cursor()
+    cursor.executemany("UPDATE users SET risk_score=? WHERE id=?", [(0.8, 1), (0.2, 2), (None, 3)])
+    users_db.commit()
+
+    columns = PatientColumns().refresh(cursor)
+    # An unscored patient counts, but not towards the average (like AVG)
+    assert columns.stats() == {"total": 3, "high_risk": 1, "avg_risk": 0.5}
+    assert columns.filter_ids(gender="Female") == [2]
+
+    # Written through another connection, as another worker would
+    other = sqlite3.connect(tmp_path / "users.db")
+    other.execute("UPDATE users SET gender='Female' WHERE id=1")
+    other.execute("DELETE FROM users WHERE id IN (2, 3)")
+    add_users(other, {"gender": "Male"})
+    other.execute("UPDATE users SET risk_score=0.4 WHERE id=4")
+    other.commit()
+    other.close()
+    columns.refresh(cursor)
+    assert columns.filter_ids(gender="Female") == [1]
+    assert columns.filter_ids(min_risk=0.4) == [1, 4]
+    assert columns.stats()["total"] == 2
+
+    # Dictionary codes widen past 16 bits instead of overflowing
+    for i in range(0x10001):
+        columns._encode("work_type", f"w{i}")
+    assert columns.codes["work_type"].typecode == "I"
+
+# Test admin patient search uses the FTS index with prefix matching
+def test_admin_user_search(users_db, client):
+    add_users(users_db, {"first_name": "Johanna", "last_name": "Smith", "email": "jo@example.com"},
+              {"first_name": "Mark", "last_name": "Jones", "email": "mark@example.com"})
+    users_db.execute("UPDATE users SET last_name='Smithson' WHERE id=2")
+    users_db.commit()
+
+    with client.session_transaction() as sess:
+        sess['role'] = 'admin'
+    response = client.get('/admin/users?q=smi')
+    assert b'jo@example.com' in response.data
+    assert b'mark@example.com' in response.data
+
+    response = client.get('/admin/users?q=joh smi')
+    assert b'jo@example.com' in response.data
+    assert b'mark@example.com' not in response.data
+
+# Test feedback search syncs from the CouchDB changes feed and filters results
+@patch('app.FEEDBACK_SYNC_INTERVAL', 0)
+@patch('app.start_background', side_effect=lambda target, name: target())  # run the sync inline
+@patch('app.feedback_db')
+def test_admin_feedback_search(mock_feedback_db, mock_start, users_db, client):
+    mock_feedback_db.changes.side_effect = [
+        {"results": [
+            {"id": "a", "doc": {"_id": "a", "user_id": 1, "rating": "5", "comment": "Very helpful doctors",
+                                "timestamp": "2024-01-01", "analysis": {"category": "High"}}},
+            {"id": "b", "doc": {"_id": "b", "user_id": 2, "rating": "2", "comment": "Helpful but slow",
+                                "timestamp": "2024-01-02", "analysis": {"category": "Low"}}},
+        ], "last_seq": "2"},
+        {"results": [{"id": "b", "deleted": True}], "last_seq": "3"},
+        {"results": [], "last_seq": "3"},
+    ]
+    with client.session_transaction() as sess:
+        sess['role'] = 'admin'
+
+    response = client.get('/admin/feedbacks/search?q=help')
+    assert b'Very helpful doctors' in response.data
+    assert b'Helpful but slow' in response.data
+    mock_feedback_db.changes.assert_called_with(since=0, include_docs=True, limit=500)
+
+    response = client.get('/admin/feedbacks/search?q=help&category=High')
+    assert b'Helpful but slow' not in response.data
+    mock_feedback_db.changes.assert_called_with(since="2", include_docs=True, limit=500)
+
+    # "b" was deleted in CouchDB after the first sync
+    response = client.get('/admin/feedbacks/search?rating=2')
+    assert b'No matching feedback.' in response.data
+
+    # Pages continue after the last (timestamp, id) or (rank, id) shown
+    mock_feedback_db.changes.side_effect = None
+    mock_feedback_db.changes.return_value = {"results": [
+        {"id": f"p{i}", "doc": {"_id": f"p{i}", "user_id": 3, "rating": "4", "comment": f"Page test {i}",
+                                "timestamp": "2024-02-01"}} for i in range(25)], "last_seq": "4"}
+    first = client.get('/admin/feedbacks/search?rating=4')
+    mock_feedback_db.changes.return_value = {"results": [], "last_seq": "4"}
+    assert b'Page test 24' in first.data and b'Page test 0<' not in first.data
+    cursor = re.search(rb'after=([^"&]+)', first.data).group(1).decode()
+    second = client.get(f'/admin/feedbacks/search?rating=4&after={cursor}')
+    assert b'Page test 0<' in second.data and b'Page test 24' not in second.data
+    assert b'Next' not in second.data
+
+    first = client.get('/admin/feedbacks/search?q=page')
+    cursor = re.search(rb'after=([^"&]+)', first.data).group(1).decode()
+    second = client.get(f'/admin/feedbacks/search?q=page&after={cursor}')
+    shown = lambda page: set(re.findall(rb'Page test \d+', page.data))
+    assert len(shown(first)) == 20 and len(shown(second)) == 5
+    assert not shown(first) & shown(second)
+
+# Test history snapshots are stored as a keyframe followed by small deltas
+@patch('app.sqlite3.connect')
+@patch('app.history_db')
+def test_delta_history(mock_history_db, mock_connect):
+    snapshot = {"first_name": "John", "age": 50, "risk_score": 0.3,
+                "medical_data": {"bmi": 25.0, "stroke": "No Stroke"}}
+
+    mock_history_db.view.return_value = []
+    keyframe = save_history_snapshot(1, snapshot)
+    assert keyframe["type"] == "keyframe"
+    assert keyframe["medical_data"]["bmi"] == 25.0
+
+    changed = dict(snapshot, risk_score=0.5, medical_data={"bmi": 31.0, "stroke": "No Stroke"})
+    mock_history_db.view.return_value = [MagicMock(doc=keyframe)]
+    delta = save_history_snapshot(1, changed)
+    assert delta["type"] == "delta"
+    assert delta["changes"] == {"risk_score": 0.5, "medical_data.bmi": 31.0}
+
+    # Nothing changed since the last snapshot: nothing is written
+    mock_history_db.view.return_value = [MagicMock(doc=delta), MagicMock(doc=keyframe)]
+    mock_history_db.save.reset_mock()
+    assert save_history_snapshot(1, changed) is None
+    mock_history_db.save.assert_not_called()
+
+    # Reading replays the deltas on top of the keyframe
+    mock_history_db.view.return_value = [MagicMock(doc=keyframe), MagicMock(doc=delta)]
+    history = load_patient_history(1)
+    assert [h["risk_score"] for h in history] == [0.3, 0.5]
+    assert history[1]["medical_data"] == {"bmi": 31.0, "stroke": "No Stroke"}
+    assert history[1]["first_name"] == "John"
+
+    # Point-in-time reads walk backwards to the nearest keyframe
+    mock_history_db.view.return_value = [MagicMock(doc=delta), MagicMock(doc=keyframe)]
+    state = patient_state_at(1, delta["timestamp"])
+    assert state["medical_data"]["bmi"] == 31.0
+
+# Test history pages read one page plus the way back to its keyframe, not the whole history
+@patch('app.history_db')
+def test_history_pages(mock_history_db, client):
+    docs = []
+    for i in range(25):
+        for user_id in (1, 2):
+            doc = {"_id": f"u{user_id}-{i:02d}", "user_id": user_id, "timestamp": f"2024-01-01T00:{i:02d}:0{user_id}"}
+            if i % 10 == 0:
+                doc.update(type="keyframe", first_name=f"P{user_id}", risk_score=i / 100, medical_data={"bmi": 20.0})
+            else:
+                doc.update(type="delta", changes={"risk_score": i / 100})
+            docs.append(doc)
+
+    # Enough of CouchDB's view semantics: key order, ranges, startkey_docid, limit
+    def view(name, include_docs, descending=False, limit=None, startkey=None, endkey=None, startkey_docid=None):
+        def norm(key):
+            return [("\uffff" if k == {} else k) for k in key] if isinstance(key, list) else key
+        key = (lambda d: [d["user_id"], d["timestamp"]]) if name == "history/by_user" else (lambda d: d["timestamp"])
+        rows = sorted((MagicMock(key=key(d), id=d["_id"], doc=d) for d in docs),
+                      key=lambda r: (norm(r.key), r.id), reverse=descending)
+        if startkey is not None:
+            start = (norm(startkey), startkey_docid or ("\uffff" if descending else ""))
+            rows = [r for r in rows if ((norm(r.key), r.id) <= start if descending else (norm(r.key), r.id) >= start)]
+        if endkey is not None:
+            rows = [r for r in rows if (norm(r.key) >= norm(endkey) if descending else norm(r.key) <= norm(endkey))]
+        return rows[:limit] if limit else rows
+    mock_history_db.view.side_effect = view
+
+    def queries(body):
+        return 200, {}, {"results": [
+            {"rows": [{"key": r.key, "id": r.id, "doc": r.doc} for r in view(
+                "history/by_user", True, descending=True, limit=q["limit"], startkey=q["startkey"],
+                endkey=q["endkey"], startkey_docid=q["startkey_docid"])]}
+            for q in body["queries"]]}
+    mock_history_db.resource.return_value.post_json.side_effect = queries
+
+    everything = [s["risk_score"] for s in reversed(load_patient_history(1))]
+    mock_history_db.view.reset_mock()
+    records, cursor = load_history_page(1, limit=7)
+    assert [r["risk_score"] for r in records] == everything[:7]
+    assert records[-1]["first_name"] == "P1"  # a delta, rebuilt from the keyframe before the page
+    assert mock_history_db.view.call_count == 1
+    assert mock_history_db.view.call_args.kwargs["limit"] == 7 + 10 + 1
+    pages = records
+    while cursor:
+        records, cursor = load_history_page(1, cursor, limit=7)
+        pages += records
+    assert [r["risk_score"] for r in pages] == everything
+    assert patient_state_at(1, "2024-01-01T00:13:01")["risk_score"] == 0.13
+
+    with client.session_transaction() as sess:
+        sess['role'] = 'admin'
+    with patch('app.HISTORY_PAGE_SIZE', 5):
+        mock_history_db.view.reset_mock()
+        page = client.get('/admin/history').data.decode()
+        assert re.findall(r'<td>(0\.\d+)</td>', page) == ['0.24', '0.24', '0.23', '0.23', '0.22']
+        # one by_time page plus one batched lookup for both patients
+        assert mock_history_db.view.call_count == 1
+        assert len(mock_history_db.resource.return_value.post_json.call_args.kwargs["body"]["queries"]) == 2
+        older = re.search(r'href="([^"]+)" class="btn">Older', page).group(1).replace('&amp;', '&')
+        page = client.get(older).data.decode()
+        assert re.findall(r'<td>(0\.\d+)</td>', page) == ['0.22', '0.21', '0.21', '0.2', '0.2']
+
+# Test the retention policy keeps recent snapshots and thins out old ones
+def test_plan_history_compaction():
+    import datetime
+    now = datetime.datetime(2024, 6, 30, 12, 0)
+
+    def doc(doc_id, days_ago, **fields):
+        ts = (now - datetime.timedelta(days=days_ago)).isoformat()
+        return dict(fields, _id=doc_id, _rev="1-x", user_id=1, timestamp=ts)
+
+    docs = [
+        doc("archived", 800, type="keyframe", age=40, risk_score=0.1),
+        doc("week-old", 200, type="delta", changes={"risk_score": 0.2}),
+        doc("week-new", 199, type="delta", changes={"risk_score": 0.3}),
+        doc("day-old", 60.2, type="delta", changes={"risk_score": 0.4}),
+        doc("day-new", 60.1, type="delta", changes={"age": 41}),
+        doc("recent", 1, type="delta", changes={"risk_score": 0.5}),
+    ]
+    changes, archive = plan_history_compaction(docs, now)
+
+    assert [a["risk_score"] for a in archive] == [0.1]
+    deleted = [c["_id"] for c in changes if c.get("_deleted")]
+    assert deleted == ["archived", "week-old", "day-old"]
+
+    # Deltas whose base was removed are rewritten as full keyframes
+    rewritten = {c["_id"]: c for c in changes if not c.get("_deleted")}
+    assert set(rewritten) == {"week-new", "day-new"}
+    assert rewritten["week-new"]["type"] == "keyframe"
+    assert rewritten["week-new"]["risk_score"] == 0.3
+    assert rewritten["day-new"]["age"] == 41
+    assert rewritten["day-new"]["risk_score"] == 0.4
+
+    # Orphan deltas go, even one whose timestamp can't be parsed
+    orphans = [doc("orphan", 1, type="delta", changes={"risk_score": 0.2}),
+               dict(doc("bogus", 1, type="delta", changes={"risk_score": 0.3}), timestamp="bogus")]
+    changes, archive = plan_history_compaction(orphans, now)
+    assert changes == [{"_id": "orphan", "_rev": "1-x", "_deleted": True},
+                       {"_id": "bogus", "_rev": "1-x", "_deleted": True}]
+    assert archive == []
+
+# Test the risk trend is updated incrementally as snapshots are written
+def test_risk_trajectory(users_db):
+    cursor = users_db.cursor()
+    update_risk_trajectory(cursor, 1, 0.2, "2024-01-01T00:00:00")
+    update_risk_trajectory(cursor, 1, 0.5, "2024-01-31T00:00:00")
+    update_risk_trajectory(cursor, 1, 0.8, "2024-03-01T00:00:00")
+    update_risk_trajectory(cursor, 1, 0.8, "2024-03-11T00:00:00")
+
+    trajectory = load_risk_trajectory(cursor, 1)
+    assert trajectory["last_category"] == "High"
+    assert trajectory["last_crossing_at"] == "2024-03-01T00:00:00"
+    assert trajectory["days_in"] == {"High": 10.0, "Medium": 30.0, "Low": 30.0}
+    assert round(trajectory["slope_per_month"], 2) == 0.27
+    assert load_risk_trajectory(cursor, 2) is None
+
+# Test the patient pages share one cached profile until the row is written
+@patch('app.history_db')
+@patch('app.feedback_db')
+def test_profile_cache(mock_feedback_db, mock_history_db, users_db, client):
+    add_users(users_db, {"first_name": "Ann", "last_name": "Lee", "gender": "Female", "age": 60,
+                         "work_type": "Private", "residence_type": "Urban", "ever_married": "Yes",
+                         "email": "ann@x.com", "bmi": 31, "avg_glucose_level": 150, "hypertension": 1,
+                         "heart_disease": 0})
+
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    with patch('app.sqlite3.connect', wraps=sqlite3.connect) as connect:
+        assert client.get('/analyze').status_code == 200
+        reads = connect.call_count
+        assert client.get('/edit_user/1').status_code == 200
+        assert client.get('/add_info').status_code == 200
+        assert client.get('/analyze').status_code == 200
+        assert connect.call_count - reads == 1  # trajectory write; data versions keep their connection
+    assert 'password' not in profile_cache.get(1)
+
+    client.post('/edit_user/1', data={'first_name': 'Anna', 'last_name': 'Lee', 'email': 'ann@x.com'})
+    assert profile_cache.get(1) is None
+    assert b'Anna' in client.get('/edit_user/1').data
+
+# Test the high risk watchlist follows risk_score changes
+def test_high_risk_watchlist(users_db, client):
+    add_users(users_db, *[{"first_name": f"P{i}", "last_name": "Test", "risk_score": risk}
+                          for i, risk in enumerate([0.9, 0.2, 0.75])])
+    users_db.execute("UPDATE high_risk_watchlist SET entered_at = '2024-01-01' WHERE user_id = 1")
+    users_db.execute("UPDATE users SET risk_score = 0.8 WHERE id = 1")   # still High
+    users_db.execute("UPDATE users SET risk_score = 0.3 WHERE id = 3")   # leaves
+    users_db.execute("UPDATE users SET risk_score = 0.95 WHERE id = 2")  # enters
+    users_db.commit()
+    assert users_db.execute("SELECT user_id, risk_score, entered_at = '2024-01-01' FROM high_risk_watchlist ORDER BY user_id").fetchall() == \
+        [(1, 0.8, 1), (2, 0.95, 0)]
+    users_db.execute("DELETE FROM users WHERE id = 2")
+    users_db.commit()
+    assert users_db.execute("SELECT user_id FROM high_risk_watchlist").fetchall() == [(1,)]
+
+    with client.session_transaction() as sess:
+        sess['role'] = 'admin'
+    response = client.get('/admin/high-risk')
+    assert response.status_code == 200
+    assert b'P0 Test' in response.data
+
+    # Keyset pages: same entered_at breaks ties on user_id
+    add_users(users_db, *[{"first_name": f"Q{i}", "last_name": "Test", "risk_score": 0.9} for i in range(4)])
+    users_db.execute("UPDATE high_risk_watchlist SET entered_at = '2024-02-01' WHERE user_id > 1")
+    users_db.commit()
+    seen = []
+    url = '/admin/high-risk'
+    with patch('app.WATCHLIST_PAGE_SIZE', 2):
+        while url:
+            page = client.get(url).data.decode()
+            seen += re.findall(r'<td>(\d+)</td>\s*<td>\w+ Test</td>', page)
+            more = re.search(r'href="([^"]+)" class="btn">Next', page)
+            url = more.group(1).replace('&amp;', '&') if more else None
+    assert seen == ['4', '5', '6', '7', '1']
+
+# Test risk_score is recomputed inside SQLite whenever the medical columns change
+@patch('app.history_db')
+def test_risk_scoring_trigger(mock_history_db, users_db, client):
+    add_users(users_db, {"age": 65}, {"age": 20})
+    assert users_db.execute("SELECT risk_score FROM users ORDER BY id").fetchall() == [(0.25,), (0.0,)]
+
+    # Bulk medical change, from a plain connection
+    users_db.execute("UPDATE users SET hypertension = 1, heart_disease = 1, bmi = 31")
+    users_db.commit()
+    assert users_db.execute("SELECT risk_score FROM users ORDER BY id").fetchall() == [(0.8,), (0.55,)]
+    assert users_db.execute("SELECT user_id FROM high_risk_watchlist").fetchall() == [(1,)]
+
+    # The trigger's rules (RISK_SQL) agree with compute_risk on every
+    # threshold edge, missing value and numeric string
+    grid = list(itertools.product([None, '', 0, 29, 30, 44, 45, 59, 59.9, 60, '60'],
+                                  [None, '', 24.9, 25, 29.99, 30, '30.5'],
+                                  [None, '', 99.9, 100, 125.9, 126, '126'],
+                                  [None, 0, 1, '1'], [None, 0, 1]))
+    columns = ("age", "bmi", "avg_glucose_level", "hypertension", "heart_disease")
+    add_users(users_db, *[dict(zip(columns, values), first_name="G") for values in grid])
+    users_db.row_factory = sqlite3.Row
+    rows = users_db.execute("SELECT * FROM users WHERE first_name = 'G'").fetchall()
+    assert len(rows) == len(grid)
+    assert [row["risk_score"] for row in rows] == [compute_risk(row) for row in rows]
+
+    with client.session_transaction() as sess:
+        sess['user_id'] = 2
+    client.post('/add_info', data={'hypertension': 0, 'heart_disease': 0, 'avg_glucose_level': 130,
+                                   'bmi': 22, 'smoking_status': 1, 'stroke': 0})
+    response = client.get('/analyze')
+    assert response.status_code == 200
+    assert b'15.0' in response.data  # glucose 130 only
+
+# Test bulk admin operations run as one batch with one _bulk_docs call
+@patch('app.history_db')
+def test_admin_bulk_users(mock_history_db, users_db, client):
+    add_users(users_db, *[{"age": 50}] * 4)
+
+    with client.session_transaction() as sess:
+        sess['role'] = 'admin'
+    response = client.post('/admin/users/bulk', data={'action': 'medical', 'user_ids': ['1', '2', '3'],
+                                                      'hypertension': '1', 'bmi': '', 'stroke': ''})
+    assert response.status_code == 302
+    assert users_db.execute("SELECT id, hypertension, risk_score FROM users ORDER BY id").fetchall() == \
+        [(1, 1, 0.35), (2, 1, 0.35), (3, 1, 0.35), (4, None, 0.15)]
+    mock_history_db.update.assert_called_once()
+    docs = mock_history_db.update.call_args[0][0]
+    assert [(d['user_id'], d['type'], d['risk_score']) for d in docs] == [(1, 'keyframe', 0.35), (2, 'keyframe', 0.35), (3, 'keyframe', 0.35)]
+    mock_history_db.save.assert_not_called()
+
+    client.post('/admin/users/bulk', data={'action': 'delete', 'user_ids': ['2', '4']})
+    assert users_db.execute("SELECT id FROM users ORDER BY id").fetchall() == [(1,), (3,)]
+
+# Test deleting a user queues their CouchDB documents and the purge removes them in bulk
+@patch('app.start_background', return_value=None)
+@patch('app.feedback_db')
+@patch('app.history_db')
+def test_purge_deleted_user(mock_history_db, mock_feedback_db, mock_start, users_db, client):
+    def fake_view(docs):
+        def view(name, startkey, endkey, include_docs, limit):
+            rows = [MagicMock(id=d["_id"], doc=d) for d in docs if d["user_id"] == startkey[0]]
+            docs[:] = [d for d in docs if d["user_id"] != startkey[0]]  # gone once deleted
+            return rows
+        return view
+    mock_history_db.view.side_effect = fake_view([{"_id": f"h{i}", "_rev": "1-a", "user_id": 2} for i in range(3)] +
+                                                 [{"_id": "h9", "_rev": "1-a", "user_id": 1}])
+    mock_feedback_db.view.side_effect = fake_view([{"_id": "f1", "_rev": "1-b", "user_id": 2}])
+    mock_history_db.update.side_effect = mock_feedback_db.update.side_effect = \
+        lambda docs: [(True, d["_id"], "2-x") for d in docs]
+
+    add_users(users_db, {}, {})
+    users_db.execute("INSERT INTO feedback_index (doc_id, user_id, comment) VALUES ('f1', 2, 'hello')")
+    users_db.commit()
+
+    with client.session_transaction() as sess:
+        sess['role'] = 'admin'
+    assert client.post('/admin/user/2/delete').status_code == 302
+    assert users_db.execute("SELECT user_id FROM purge_queue").fetchall() == [(2,)]
+    assert mock_start.call_args.args[1] == "purge-deleted-users"
+
+    assert process_purge_queue() == {"users": 1, "documents": 4, "failed": 0}
+    deleted = [d for call in mock_history_db.update.call_args_list for d in call[0][0]]
+    assert deleted == [{"_id": f"h{i}", "_rev": "1-a", "_deleted": True} for i in range(3)]
+    mock_feedback_db.update.assert_called_once_with([{"_id": "f1", "_rev": "1-b", "_deleted": True}])
+    assert users_db.execute("SELECT COUNT(*) FROM purge_queue").fetchone()[0] == 0
+    assert users_db.execute("SELECT COUNT(*) FROM feedback_index").fetchone()[0] == 0
+
+# Test the in-process and SQLite document stores answer the same queries
+def test_docstore_backends(tmp_path):
+    docs = [{"user_id": u, "timestamp": f"2024-01-{d:02d}T00:00:00", "rating": d % 5 + 1}
+            for u in (1, 2, 3) for d in range(1, 11)]
+    docs.append({"user_id": 2, "timestamp": "2024-01-05T00:00:00", "rating": "n/a"})
+    results = []
+    for store in (MemoryStore(), SQLiteStore(str(tmp_path / "docs.db"), "feedback")):
+        store.save(docs[0])
+        store.save_many(docs[1:])
+        pages, before = [], None
+        while True:
+            page = store.page(before=before, limit=7)
+            if not page:
+                break
+            pages.append([(d["user_id"], d["timestamp"]) for d in page])
+            before = (page[-1]["timestamp"], page[-1]["_id"])
+        results.append((
+            [d["timestamp"] for d in store.by_user(2)],
+            [d["timestamp"] for d in store.by_user(3, limit=2)],
+            sorted(sum(pages, [])) == sorted((d["user_id"], d["timestamp"]) for d in docs),
+            [len(p) for p in pages],
+            store.aggregate("user_id", "rating"),
+        ))
+    assert results[0] == results[1]
+    assert results[0][1] == ["2024-01-01T00:00:00", "2024-01-02T00:00:00"]
+    assert results[0][2] is True
+    assert results[0][4][2] == {"count": 11, "avg": 3.0}
+
+# Test unchanged pages answer 304 without running the view
+@patch('app.feedback_db')
+@patch('app.history_db')
+def test_conditional_get(mock_history_db, mock_feedback_db, users_db, client):
+    add_users(users_db, {"age": 50}, {"age": 50})
+
+    saved = []
+    mock_feedback_db.info.return_value = {"update_seq": "1-a"}
+    mock_history_db.save.side_effect = saved.append
+    mock_history_db.view.side_effect = lambda *a, **k: [MagicMock(doc=d) for d in reversed(saved)]
+
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    client.get('/analyze')  # first visit records a snapshot, which is a change
+    first = client.get('/analyze')
+    assert len(saved) == 1
+    assert first.status_code == 200 and first.headers['ETag'].startswith('W/')
+    etag = first.headers['ETag']
+
+    with patch('app.load_profile') as load_profile:
+        again = client.get('/analyze', headers={'If-None-Match': etag})
+        assert again.status_code == 304
+        load_profile.assert_not_called()
+    assert 'Last-Modified' not in first.headers  # one-second dates can't tell two writes apart
+
+    # A change in CouchDB, made by anyone, counts
+    mock_feedback_db.info.return_value = {"update_seq": "2-b"}
+    etag = client.get('/analyze', headers={'If-None-Match': etag}).headers['ETag']
+    assert client.get('/analyze', headers={'If-None-Match': etag}).status_code == 304
+
+    # Another patient's change doesn't matter, our own does
+    users_db.execute("UPDATE users SET bmi = 33 WHERE id = 2")
+    users_db.commit()
+    assert client.get('/analyze', headers={'If-None-Match': etag}).status_code == 304
+    client.post('/add_info', data={'hypertension': 1, 'heart_disease': 0, 'avg_glucose_level': 90,
+                                   'bmi': 22, 'smoking_status': 1, 'stroke': 0})
+    client.get('/dashboard')  # shows the flash message
+    assert client.get('/analyze', headers={'If-None-Match': etag}).status_code == 200
+
+# Test built assets get hashed names, precompressed copies and immutable caching
+def test_build_assets(tmp_path, client):
+    import shutil
+    static_dir = str(tmp_path / "static")
+    shutil.copytree(app.static_folder, static_dir)
+    original = app.static_folder
+    app.static_folder = static_dir
+    try:
+        manifest = build_assets(static_dir)
+        load_asset_manifest()
+        hashed = manifest['style.css']
+        assert hashed.startswith('style.') and hashed.endswith('.css') and hashed != 'style.css'
+        assert os.path.exists(os.path.join(static_dir, 'dist', hashed + '.gz'))
+        assert not os.path.exists(os.path.join(static_dir, 'dist', manifest['abc.jpg'] + '.gz'))
+
+        with app.test_request_context():
+            assert url_for('static', filename='style.css') == '/static/dist/' + hashed
+
+        response = client.get('/static/dist/' + hashed, headers={'Accept-Encoding': 'gzip, deflate'})
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.headers['Content-Type'].startswith('text/css')
+        assert 'immutable' in response.headers['Cache-Control']
+        with open(os.path.join(static_dir, 'style.css'), 'rb') as f:
+            assert gzip.decompress(response.data) == f.read()
+
+        plain = client.get('/static/dist/' + hashed)
+        assert 'Content-Encoding' not in plain.headers
+    finally:
+        app.static_folder = original
+        load_asset_manifest()
+
+# Test large admin pages are compressed (streamed and buffered) and small ones left alone
+@patch('app.feedback_db')
+def test_response_compression(mock_feedback_db, client):
+    rows = []
+    for i in range(300):
+        row = MagicMock()
+        row.doc = {"user_id": i, "rating": "4", "comment": f"Comment number {i}", "timestamp": "2024-01-01"}
+        rows.append(row)
+    mock_feedback_db.view.return_value = rows
+    with client.session_transaction() as sess:
+        sess['role'] = 'admin'
+
+    response = client.get('/admin/feedbacks', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Length' not in response.headers  # streamed
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    page = gzip.decompress(response.data)
+    assert b'Comment number 299' in page
+    assert len(response.data) * 3 < len(page)
+
+    plain = client.get('/admin/feedbacks')
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.data == page
+
+    with patch('app.sqlite3.connect') as mock_connect, patch('app.load_data_versions', return_value=[]):
+        mock_connect.return_value.cursor.return_value.fetchall.return_value = [
+            (i, 'First', 'Last', 'Male', 40, 'Private', 'Urban', 'Yes', f'p{i}@example.com',
+             0, 0, 90.0, 22.0, 0, 0, '2024-01-01', None, None, None) for i in range(50)]
+        buffered = client.get('/admin/users', headers={'Accept-Encoding': 'gzip'})
+    assert buffered.headers['Content-Encoding'] == 'gzip'
+    assert int(buffered.headers['Content-Length']) == len(buffered.data)
+    assert b'p49@example.com' in gzip.decompress(buffered.data)
+
+    with client.session_transaction() as sess:
+        sess['role'] = 'user'
+    small = client.get('/admin/feedbacks', headers={'Accept-Encoding': 'gzip'})
+    assert small.status_code == 302
+    assert 'Content-Encoding' not in small.headers
+
+# Test database clients are only created on first use and again after a fork
+def test_client_factory():
+    from client_factory import ClientFactory
+    with patch('client_factory.couchdb.Server') as mock_server:
+        server = mock_server.return_value
+        server.__contains__.return_value = False
+        setup = MagicMock()
+        clients = ClientFactory(couch_url="http://couch:5984/", couch_max_idle=1)
+        history = clients.couch_db("patient_history", setup=setup)
+        # mock.patch / inspect probing the handle must not connect
+        assert not hasattr(history, '__func__') and not hasattr(history, '_mock_methods')
+        assert mock_server.call_count == 0
+        assert clients.metrics()["couchdb"] is None
+
+        history.save({"_id": "a"})
+        history.save({"_id": "b"})
+        assert mock_server.call_count == 1
+        server.create.assert_called_once_with("patient_history")
+        setup.assert_called_once_with(server.create.return_value)
+        assert server.create.return_value.save.call_count == 2
+
+        # Only max_idle connections are kept after release
+        pool = clients._couch_pool
+        first, second = MagicMock(), MagicMock()
+        pool.release("http://couch:5984/x", first)
+        pool.in_use += 1
+        pool.release("http://couch:5984/x", second)
+        second.close.assert_called_once()
+        assert clients.metrics()["couchdb"]["idle"] == 1
+
+        clients._forget()  # what a forked child does
+        history.info()
+        assert mock_server.call_count == 2
+        clients.close()
+        assert clients.metrics()["couchdb"] is None
+
+# Test create_app sets up the databases once and pools connections per worker
+def test_create_app(tmp_path):
+    import app as app_module
+    users, admins = str(tmp_path / "users.db"), str(tmp_path / "admins.db")
+    saved = (app_module.DB_PATH_USERS, app_module.DB_PATH_ADMINS, dict(app.config))
+    try:
+        with patch('app.init_db', wraps=app_module.init_db) as mock_init:
+            created = app_module.create_app({"USERS_DB": users, "ADMINS_DB": admins, "SQLITE_POOL_SIZE": 1,
+                                             "TRUSTED_PROXIES": 1})
+            assert app.wsgi_app.x_for == 1  # client address from the proxy's X-Forwarded-For
+            app_module.create_app({"TRUSTED_PROXIES": 0})
+            assert app.wsgi_app is app_module._wsgi_app
+        assert created is app
+        assert mock_init.call_count == 1
+        assert app_module.DB_PATH_USERS == users
+
+        conn = app_module.db_connect(users)
+        conn.row_factory = sqlite3.Row
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0
+        conn.close()
+        again = app_module.db_connect(users)
+        assert again is conn and again.row_factory is None
+        other = app_module.db_connect(users)
+        assert other is not conn
+        again.close()
+        other.close()  # pool is full, really closed
+        with pytest.raises(sqlite3.ProgrammingError):
+            other.execute("SELECT 1")
+    finally:
+        app_module.DB_PATH_USERS, app_module.DB_PATH_ADMINS = saved[:2]
+        app.config.clear()
+        app.config.update(saved[2])
+        app.wsgi_app = app_module._wsgi_app
+        app_module.sqlite_pool = None
+
+# Test repeated logins are refused before the database lookup and password check
+def test_login_throttle(client, tmp_path):
+    with patch('app.sqlite3.connect') as mock_connect, patch('app.check_password_hash') as mock_check_password:
+        mock_connect.return_value.cursor.return_value.fetchone.return_value = (
+            1, 'John', 'Doe', 'john@example.com', 'hash', 'user')
+        mock_check_password.return_value = False
+        for _ in range(5):
+            response = client.post('/login', data={'email': 'John@example.com', 'password': 'bad', 'role': 'user'})
+            assert response.status_code == 302
+        connects = mock_connect.call_count
+
+        response = client.post('/login', data={'email': 'john@example.com', 'password': 'bad', 'role': 'user'})
+        assert response.status_code == 429
+        assert b'Too many login attempts' in response.data
+        assert int(response.headers['Retry-After']) > 0
+        assert mock_connect.call_count == connects
+        assert mock_check_password.call_count == 5
+
+        # Other accounts from the same address still get through
+        response = client.post('/login', data={'email': 'jane@example.com', 'password': 'bad', 'role': 'user'})
+        assert response.status_code == 302
+
+        # A successful login clears the account's bucket
+        login_throttle.clear()
+        mock_check_password.return_value = True
+        for _ in range(5):
+            client.post('/login', data={'email': 'john@example.com', 'password': 'good', 'role': 'user'})
+        assert login_throttle.hit('email', 'john@example.com') == 0
+
+    # Workers sharing a file share the limits
+    from app import LoginThrottle
+    path = str(tmp_path / "throttle.db")
+    a = LoginThrottle({"email": (2, 60.0)}, path=path)
+    b = LoginThrottle({"email": (2, 60.0)}, path=path)
+    assert a.hit('email', 'x') == 0 and b.hit('email', 'x') == 0
+    assert a.hit('email', 'x') > 0 and b.hit('email', 'x') > 0
+    assert a.full_at == {} and b.hit('email', 'y') == 0
+
+    # A file that can't be opened falls back to per-process limits
+    broken = LoginThrottle({"email": (1, 60.0)}, path=str(tmp_path / "missing" / "throttle.db"))
+    assert broken.path is None
+    assert broken.hit('email', 'x') == 0 and broken.hit('email', 'x') > 0
+
 # Run tests with pytest
 if __name__ == '__main__':
     pytest.main()